@@ -1,6 +1,8 @@
 # pylint: disable-all
 #!/usr/bin/env python3
 
+from cyrusbus.hooks import current_stack, callback_name
+
 
 class Bus:
 
@@ -9,6 +11,7 @@ class Bus:
     def __init__(self, name=None):
         if name:
             Bus._instances[name] = self
+        self.hooks = []
         self.reset()
 
     @staticmethod
@@ -163,6 +166,85 @@ class Bus:
         if not key_found:
             return self
 
+    def _publish_with_hooks(self, key, *args, **kwargs):
+        # Installed as the instance's publish by add_hook, so buses without
+        # hooks keep the direct calls of publish above. The matching and the
+        # return value must stay identical to publish.
+        token = current_stack.set(current_stack.get() + (key,))
+        try:
+            for hook in tuple(self.hooks):
+                hook.before_publish(self, key, args, kwargs)
+
+            if '*' in self.subscriptions:
+                for subscriber in self.subscriptions['*']:
+                    self._invoke_with_hooks(key, subscriber['callback'], (self, key) + args, kwargs)
+
+            key_found = False
+
+            for subscriber_key in self.subscriptions.keys():
+                if key.startswith(subscriber_key):
+                    key_found = True
+                    for subscriber in self.subscriptions[subscriber_key]:
+                        self._invoke_with_hooks(key, subscriber['callback'], (self,) + args, kwargs)
+        finally:
+            current_stack.reset(token)
+
+        if not key_found:
+            return self
+
+    def _invoke_with_hooks(self, key, callback, args, kwargs):
+        # Every hook whose before_callback returned gets exactly one of
+        # after_callback or on_error, even when a later hook or the callback
+        # raises a BaseException, so hooks can always close what they opened.
+        hooks = tuple(self.hooks)
+        started = []
+        token = current_stack.set(current_stack.get() + (callback_name(callback),))
+        try:
+            try:
+                for hook in hooks:
+                    hook.before_callback(self, key, callback)
+                    started.append(hook)
+
+                callback(*args, **kwargs)
+            except BaseException as error:
+                for hook in started:
+                    hook.on_error(self, key, callback, error)
+                raise
+
+            for hook in hooks:
+                hook.after_callback(self, key, callback)
+        finally:
+            current_stack.reset(token)
+
+    def add_hook(self, hook):
+        """
+        Registers a hook that gets notified before each publish and around each callback (see cyrusbus.hooks.Hook).
+
+        The first hook installs a hooked publish on this instance, so buses without hooks keep running the plain method. While hooks are registered the hooked publish shadows publish on this instance, so an override of publish in a subclass is bypassed until the last hook is removed. As the hooked publish is a bound method stored on the instance, the bus holds a reference cycle to itself until the last hook is removed; the garbage collector still reclaims it.
+
+        :param hook: The hook instance.
+        :return: The busobject.
+        """
+        if hook not in self.hooks:
+            self.hooks.append(hook)
+        self.publish = self._publish_with_hooks
+
+        return self
+
+    def remove_hook(self, hook):
+        """
+        Unregisters a hook. Once the last hook is removed publish runs without any tracing overhead again.
+
+        :param hook: The hook instance.
+        :return: The busobject.
+        """
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+        if not self.hooks:
+            self.__dict__.pop('publish', None)
+
+        return self
+
     def reset(self):
         """
         Resets the eventbus. All subscribers will be cleared.
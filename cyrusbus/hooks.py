@@ -0,0 +1,190 @@
+# pylint: disable-all
+#!/usr/bin/env python3
+
+import contextvars
+import functools
+import threading
+import time
+from collections import Counter
+
+
+# The chain of event keys and callback names that led to the code currently
+# running. The bus only maintains it while hooks are registered. Because it is
+# a context variable, asyncio tasks inherit it automatically and threads can
+# inherit it through propagate().
+current_stack = contextvars.ContextVar('cyrusbus_current_stack', default=())
+
+
+# The frames each FlameGraphSampler has open in the current context, keyed by
+# sampler. Context variables must live at module level, so all samplers share
+# this one.
+_sampler_frames = contextvars.ContextVar('cyrusbus_sampler_frames', default=None)
+
+
+def propagate(function):
+    """
+    Wraps a function so it runs inside a copy of the current context. Use it when handing work from a callback to another thread, so the event context follows.
+
+    :param function: The function that will be executed in another thread.
+    :return: A callable that runs the function with the context captured at wrap time. Each call gets its own copy, so the callable can be used from several threads at once.
+    """
+    context = contextvars.copy_context()
+
+    def run_in_context(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return run_in_context
+
+
+def callback_name(callback):
+    """
+    Returns a readable name for a callback, used as a frame in the event stack. Partials are named after the function they wrap and callable objects after their class, so names are stable between runs.
+
+    :param callback: The callback function.
+    :return: The qualified name of the callback.
+    """
+    while isinstance(callback, functools.partial):
+        callback = callback.func
+
+    name = getattr(callback, '__qualname__', None)
+    if name is None:
+        name = type(callback).__qualname__
+
+    return name
+
+
+class Hook:
+    """
+    Base class for bus hooks. Override the events you are interested in; the default implementations do nothing.
+    """
+
+    def before_publish(self, bus, key, args, kwargs):
+        """
+        Called once per publish, before any callback is run.
+        """
+
+    def before_callback(self, bus, key, callback):
+        """
+        Called right before a subscribed callback is run. Once it returned, either after_callback or on_error is called for the same callback.
+        """
+
+    def after_callback(self, bus, key, callback):
+        """
+        Called right after a subscribed callback returned.
+        """
+
+    def on_error(self, bus, key, callback, error):
+        """
+        Called when a subscribed callback, or the before_callback of a later hook, raised. The exception is re-raised after all hooks have been called.
+        """
+
+
+class _Frame:
+
+    __slots__ = ('stack', 'parent', 'sampled', 'started', 'children', 'token')
+
+    def __init__(self, stack, parent, sampled):
+        self.stack = stack
+        self.parent = parent
+        self.sampled = sampled
+        self.started = time.perf_counter_ns()
+        self.children = 0
+        self.token = None
+
+
+def _frame_name(part):
+    # flamegraph.pl splits frames on ';' and the count off the last space
+    return part.replace(';', ':').replace(' ', '_').replace('\r', '_').replace('\n', '_')
+
+
+class FlameGraphSampler(Hook):
+    """
+    Records the time spent in callbacks and writes it as collapsed stacks, the input format of flamegraph.pl and speedscope.
+
+    Each line looks like ``event.key;callback;nested.key;nested_callback 1234`` where the value is the self time in microseconds. Only one in ``every`` outermost callbacks is recorded, together with everything it triggers, which keeps the cost low on hot paths.
+
+    Callbacks run in threads through propagate() or in asyncio tasks are subtracted from their parent's self time as long as the parent waits for them. Concurrent children may add up to more than the parent's wall time, which is then clamped to zero.
+    """
+
+    def __init__(self, path=None, every=1):
+        self.path = path
+        self.every = every
+        self.samples = Counter()
+        self._roots = 0
+        self._lock = threading.Lock()
+
+    def before_callback(self, bus, key, callback):
+        stack = current_stack.get()
+        frames = _sampler_frames.get() or {}
+        parent = frames.get(self)
+
+        # skip frames left open by a callback whose after_callback raised
+        while parent is not None and (len(parent.stack) >= len(stack) or stack[:len(parent.stack)] != parent.stack):
+            parent = parent.parent
+
+        if parent is None:
+            with self._lock:
+                self._roots += 1
+                sampled = self._roots % self.every == 0
+        else:
+            sampled = parent.sampled
+
+        frame = _Frame(stack, parent, sampled)
+        frames = dict(frames)
+        frames[self] = frame
+        frame.token = _sampler_frames.set(frames)
+
+    def after_callback(self, bus, key, callback):
+        self._record()
+
+    def on_error(self, bus, key, callback, error):
+        self._record()
+
+    def _record(self):
+        stack = current_stack.get()
+        frames = _sampler_frames.get() or {}
+        frame = frames.get(self)
+
+        while frame is not None and frame.stack != stack:
+            frame = frame.parent
+
+        # the sampler was added while this callback was already running
+        if frame is None:
+            return
+
+        elapsed = time.perf_counter_ns() - frame.started
+
+        try:
+            _sampler_frames.reset(frame.token)
+        except (ValueError, RuntimeError):
+            frames = dict(frames)
+            frames[self] = frame.parent
+            _sampler_frames.set(frames)
+
+        if not frame.sampled:
+            return
+
+        line = ';'.join(_frame_name(part) for part in stack)
+        with self._lock:
+            if frame.parent is not None:
+                frame.parent.children += elapsed
+            self.samples[line] += max(elapsed - frame.children, 0)
+
+    def write(self, path=None):
+        """
+        Writes the recorded stacks to a file.
+
+        :param path: The file to write to. Defaults to the path given to the constructor.
+        """
+        with self._lock:
+            lines = ['{} {}\n'.format(stack, value // 1000) for stack, value in sorted(self.samples.items())]
+
+        with open(path or self.path, 'w') as stack_file:
+            stack_file.writelines(lines)
+
+    def reset(self):
+        """
+        Clears all recorded stacks.
+        """
+        with self._lock:
+            self.samples.clear()
@@ -0,0 +1,319 @@
+# pylint: disable-all
+#!/usr/bin/env python3
+
+import asyncio
+import functools
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from cyrusbus import Bus
+from cyrusbus.hooks import Hook, FlameGraphSampler, current_stack, propagate, _sampler_frames
+
+
+def noop(bus):
+    pass
+
+
+class RecordingHook(Hook):
+    def __init__(self):
+        self.events = []
+
+    def before_publish(self, bus, key, args, kwargs):
+        self.events.append(('before_publish', key, args, kwargs))
+
+    def before_callback(self, bus, key, callback):
+        self.events.append(('before_callback', key, current_stack.get()))
+
+    def after_callback(self, bus, key, callback):
+        self.events.append(('after_callback', key))
+
+    def on_error(self, bus, key, callback, error):
+        self.events.append(('on_error', key, error))
+
+
+class TestHooks(unittest.TestCase):
+    def callback(self, bus, argument):
+        self.argument = argument
+        self.stack = current_stack.get()
+
+    def setUp(self):
+        self.bus = Bus()
+        self.hook = RecordingHook()
+        self.argument = None
+        self.stack = None
+
+    def test_publish_is_not_wrapped_without_hooks(self):
+        assert 'publish' not in self.bus.__dict__
+
+    def test_add_hook_is_chainable(self):
+        bus = self.bus.add_hook(self.hook)
+        assert bus == self.bus
+
+    def test_remove_last_hook_restores_plain_publish(self):
+        self.bus.add_hook(self.hook).remove_hook(self.hook)
+
+        assert 'publish' not in self.bus.__dict__
+        assert not self.bus.hooks
+
+    def test_hooks_are_called_in_order(self):
+        self.bus.subscribe('test.key', self.callback).add_hook(self.hook)
+
+        result = self.bus.publish('test.key', argument="something")
+
+        assert result is None
+        assert self.argument == "something"
+        assert [event[0] for event in self.hook.events] == ['before_publish', 'before_callback', 'after_callback']
+        assert self.hook.events[0] == ('before_publish', 'test.key', (), {'argument': "something"})
+
+    def test_publish_returns_the_same_with_and_without_hooks(self):
+        plain = Bus().subscribe('test.key', self.callback)
+        hooked = Bus().subscribe('test.key', self.callback).add_hook(self.hook)
+
+        assert plain.publish('test.key', argument="x") == hooked.publish('test.key', argument="x")
+        assert plain.publish('other.key') is plain
+        assert hooked.publish('other.key') is hooked
+
+    def test_hook_added_by_callback_is_not_called_for_running_callback(self):
+        late_hook = RecordingHook()
+
+        def adding(bus):
+            bus.add_hook(late_hook)
+
+        self.bus.subscribe('test.key', adding).add_hook(self.hook)
+        self.bus.publish('test.key')
+
+        assert late_hook.events == []
+
+        self.bus.publish('test.key')
+
+        assert [event[0] for event in late_hook.events] == ['before_publish', 'before_callback', 'after_callback']
+
+    def test_hooks_see_catch_all_subscribers(self):
+        self.bus.subscribe('*', self.callback).add_hook(self.hook)
+
+        self.bus.publish('test.key')
+
+        assert self.argument == 'test.key'
+        assert [event[0] for event in self.hook.events] == ['before_publish', 'before_callback', 'after_callback']
+
+    def test_on_error_is_called_and_error_reraised(self):
+        def failing(bus):
+            raise ValueError("boom")
+
+        self.bus.subscribe('test.key', failing).add_hook(self.hook)
+
+        with self.assertRaises(ValueError):
+            self.bus.publish('test.key')
+
+        assert self.hook.events[-1][0] == 'on_error'
+        assert isinstance(self.hook.events[-1][2], ValueError)
+        assert current_stack.get() == ()
+
+    def test_context_is_visible_to_callbacks(self):
+        self.bus.subscribe('test.key', self.callback).add_hook(self.hook)
+
+        self.bus.publish('test.key.sub', argument="something")
+
+        assert self.stack == ('test.key.sub', self.callback.__qualname__)
+        assert current_stack.get() == ()
+
+    def test_nested_publish_extends_context(self):
+        def outer(bus):
+            bus.publish('inner', argument="nested")
+
+        self.bus.subscribe('outer', outer).subscribe('inner', self.callback).add_hook(self.hook)
+
+        self.bus.publish('outer')
+
+        assert self.stack == ('outer', outer.__qualname__, 'inner', self.callback.__qualname__)
+
+    def test_context_propagates_to_threads(self):
+        def handler(bus):
+            thread = threading.Thread(target=propagate(self.bus.publish), args=('threaded',), kwargs={'argument': "hi"})
+            thread.start()
+            thread.join()
+
+        self.bus.subscribe('start', handler).subscribe('threaded', self.callback).add_hook(self.hook)
+
+        self.bus.publish('start')
+
+        assert self.argument == "hi"
+        assert self.stack == ('start', handler.__qualname__, 'threaded', self.callback.__qualname__)
+
+    def test_propagated_function_runs_in_several_threads_at_once(self):
+        barrier = threading.Barrier(4)
+
+        def work(number):
+            barrier.wait(timeout=5)
+            return current_stack.get()
+
+        def handler(bus):
+            with ThreadPoolExecutor(4) as executor:
+                self.stack = list(executor.map(propagate(work), range(4)))
+
+        self.bus.subscribe('start', handler).add_hook(self.hook)
+
+        self.bus.publish('start')
+
+        assert self.stack == [('start', handler.__qualname__)] * 4
+
+    def test_context_propagates_to_asyncio_tasks(self):
+        async def later():
+            return current_stack.get()
+
+        def handler(bus):
+            self.stack = asyncio.run(later())
+
+        self.bus.subscribe('start', handler).add_hook(self.hook)
+
+        self.bus.publish('start')
+
+        assert self.stack == ('start', handler.__qualname__)
+
+
+class TestFlameGraphSampler(unittest.TestCase):
+    def test_writes_collapsed_stacks(self):
+        def inner(bus):
+            pass
+
+        def outer(bus):
+            bus.publish('inner')
+
+        path = os.path.join(tempfile.mkdtemp(), 'bus.stacks')
+        sampler = FlameGraphSampler(path)
+        bus = Bus().subscribe('inner', inner).subscribe('outer', outer).add_hook(sampler)
+
+        bus.publish('outer')
+        sampler.write()
+
+        with open(path) as stack_file:
+            lines = stack_file.read().splitlines()
+
+        stacks = [line.rsplit(' ', 1)[0] for line in lines]
+        assert stacks == [
+            'outer;{}'.format(outer.__qualname__),
+            'outer;{};inner;{}'.format(outer.__qualname__, inner.__qualname__),
+        ]
+        assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+    def test_sampler_added_inside_callback(self):
+        sampler = FlameGraphSampler()
+
+        def adding(bus):
+            bus.add_hook(sampler)
+
+        bus = Bus().subscribe('test.key', adding).add_hook(Hook())
+        bus.publish('test.key')
+
+        assert not sampler.samples
+
+    def test_sampler_survives_failing_hook(self):
+        class FailingHook(Hook):
+            def before_callback(self, bus, key, callback):
+                raise RuntimeError("hook failed")
+
+        sampler = FlameGraphSampler()
+        bus = Bus().subscribe('test.key', noop).add_hook(sampler).add_hook(FailingHook())
+
+        with self.assertRaises(RuntimeError):
+            bus.publish('test.key')
+
+        assert not (_sampler_frames.get() or {}).get(sampler)
+
+        bus.remove_hook(bus.hooks[-1])
+        bus.publish('test.key')
+
+        assert list(sampler.samples) == ['test.key;noop']
+
+    def test_on_error_keeps_original_exception(self):
+        def failing(bus):
+            raise ValueError("boom")
+
+        sampler = FlameGraphSampler()
+        bus = Bus().subscribe('test.key', failing).add_hook(sampler)
+
+        with self.assertRaises(ValueError):
+            bus.publish('test.key')
+
+        assert 'test.key;' + failing.__qualname__ in sampler.samples
+
+    def test_frames_are_sanitized(self):
+        sampler = FlameGraphSampler()
+        bus = Bus().subscribe('a;b', noop).add_hook(sampler)
+
+        bus.publish('a;b')
+
+        assert list(sampler.samples) == ['a:b;noop']
+
+    def test_keyboard_interrupt_closes_frame(self):
+        def interrupted(bus):
+            raise KeyboardInterrupt()
+
+        sampler = FlameGraphSampler()
+        bus = Bus().subscribe('test.key', interrupted).add_hook(sampler)
+
+        with self.assertRaises(KeyboardInterrupt):
+            bus.publish('test.key')
+
+        assert not (_sampler_frames.get() or {}).get(sampler)
+        assert 'test.key;' + interrupted.__qualname__ in sampler.samples
+
+    def test_frames_are_named_stably(self):
+        sampler = FlameGraphSampler()
+        bus = Bus().subscribe('a b\rc\nd', functools.partial(noop)).add_hook(sampler)
+
+        bus.publish('a b\rc\nd')
+
+        assert list(sampler.samples) == ['a_b_c_d;noop']
+
+    def test_records_one_in_every_root_callbacks(self):
+        def outer(bus):
+            bus.publish('inner')
+
+        sampler = FlameGraphSampler(every=2)
+        bus = Bus().subscribe('outer', outer).subscribe('inner', noop).add_hook(sampler)
+
+        for _ in range(4):
+            bus.publish('outer')
+
+        assert sampler._roots == 4
+        assert set(sampler.samples) == {
+            'outer;{}'.format(outer.__qualname__),
+            'outer;{};inner;noop'.format(outer.__qualname__),
+        }
+
+        sampler.reset()
+        bus.publish('outer')
+
+        assert not sampler.samples
+
+    def test_child_in_thread_is_subtracted_from_parent(self):
+        def child(bus):
+            time.sleep(0.05)
+
+        def parent(bus):
+            thread = threading.Thread(target=propagate(bus.publish), args=('child',))
+            thread.start()
+            thread.join()
+
+        sampler = FlameGraphSampler()
+        bus = Bus().subscribe('parent', parent).subscribe('child', child).add_hook(sampler)
+
+        bus.publish('parent')
+
+        parent_time = sampler.samples['parent;{}'.format(parent.__qualname__)]
+        child_time = sampler.samples['parent;{};child;{}'.format(parent.__qualname__, child.__qualname__)]
+        assert parent_time < child_time / 2, (parent_time, child_time)
+
+    def test_reset_clears_samples(self):
+        sampler = FlameGraphSampler()
+        bus = Bus().subscribe('test.key', lambda bus: None).add_hook(sampler)
+
+        bus.publish('test.key')
+        assert sampler.samples
+
+        sampler.reset()
+        assert not sampler.samples